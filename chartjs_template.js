@@ -28,7 +28,12 @@ Usage:
                 url="/api/agent/data/users?as_chartjs=true&groupby=email,count",
                 type="bubble", // type of graph (line,pie,bar,doughnut,polarArea)
                 graph_label="Testing", // header of graph
+                refresh=0, // seconds between refreshes, only the rows added since the last refresh are fetched (0=off)
             );
+
+            // draw a time series (one query, a dataset per category)
+            // url="/api/agent/data/events?as_chartjs=true&groupby=date_added,date_trunc,hour;data.category&limit=1000"
+            // url="/api/agent/data/events?as_chartjs=true&groupby=date_added,bucket,300;data.sale,sum;data.sale,avg&limit=1000"
         });
       </script>
     </body>
@@ -36,7 +41,7 @@ Usage:
 */
 
 function draw_chartjs(selector,type,labels,values,graph_label="Graph") {
-  new Chart(document.getElementById(selector), {
+  return new Chart(document.getElementById(selector), {
     type: type,
     data: {
       labels: labels,
@@ -67,14 +72,104 @@ function draw_chartjs(selector,type,labels,values,graph_label="Graph") {
   });
 };
 
-function cjs_init(selector,url,type,graph_label) {
+function draw_chartjs_series(selector,type,labels,datasets) {
+  // Multiple series (groupby with aggregates, time buckets or more than one field)
+  var series = [];
+  $.each(datasets,function(i) {
+    series.push({
+      label: datasets[i]["label"],
+      borderColor: datasets[i]["color"],
+      backgroundColor: datasets[i]["color"],
+      fill: false,
+      borderWidth: 1,
+      data: datasets[i]["data"]
+    });
+  });
+  return new Chart(document.getElementById(selector), {
+    type: type,
+    data: {
+      labels: labels,
+      datasets: series
+    },
+    options: {
+      responsive:true,
+      maintainAspectRatio: false,
+      legend: {
+        labels: {
+          fontColor:"white"
+        }
+      }
+    }
+  });
+};
+
+function cjs_init(selector,url,type,graph_label,refresh=0) {
     $.ajax({
         type: "GET",
         url: url,
+        data: refresh ? {"etag":"true"} : {},
         contentType: 'application/json',
         success: function(result) {
-            draw_chartjs(selector,type,result["label"],result["data"],graph_label);
+            var chart;
+            // Results over a sample (sample=system,1) are scaled estimates
+            if (result["approximate"]) {
+                graph_label = "~ " + graph_label + " (sampled, ±" + Math.round((result["sample"]["error"] || 0)*100) + "%)";
+                $.each(result["datasets"] || [],function(i) {
+                    result["datasets"][i]["label"] = "~ " + result["datasets"][i]["label"];
+                });
+            }
+            if (result["datasets"] && result["datasets"].length > 1) {
+                chart = draw_chartjs_series(selector,type,result["labels"],result["datasets"]);
+            } else {
+                chart = draw_chartjs(selector,type,result["label"],result["data"],graph_label);
+            }
+            if (refresh) {
+                cjs_refresh(chart,url,result["since"],refresh);
+            }
         },
         error: function(result) {console.log(result);}
     });
 }
+
+function cjs_refresh(chart,url,since,refresh) {
+    // Every `refresh` seconds, fetch the groups of the rows added since the last response and add them to the chart
+    // (count and sum values). An unchanged result is answered with 304 (ETag)
+    setInterval(function() {
+        $.ajax({
+            type: "GET",
+            url: url,
+            data: {"since":since},
+            ifModified: true,
+            contentType: 'application/json',
+            success: function(result,status) {
+                if (status == "notmodified" || !result) {
+                    return;
+                }
+                since = result["since"];
+                cjs_merge(chart,result);
+            },
+            error: function(result) {console.log(result);}
+        });
+    },refresh*1000);
+}
+
+function cjs_merge(chart,result) {
+    // Add the values of a delta to the chart, new labels (ie. a new time bucket) are appended
+    var series = result["datasets"] && result["datasets"].length > 1;
+    var labels = series ? result["labels"] : result["label"];
+    var datasets = series ? result["datasets"] : [{"label":chart.data.datasets[0].label,"data":result["data"]}];
+    $.each(labels,function(i) {
+        var index = chart.data.labels.indexOf(labels[i]);
+        if (index == -1) {
+            chart.data.labels.push(labels[i]);
+            index = chart.data.labels.length-1;
+        }
+        $.each(datasets,function(d) {
+            var target = series ? chart.data.datasets.find(function(s) {return s.label == datasets[d]["label"];}) : chart.data.datasets[0];
+            if (target && datasets[d]["data"][i] != null) {
+                target.data[index] = (target.data[index] || 0) + datasets[d]["data"][i];
+            }
+        });
+    });
+    chart.update();
+}
@@ -17,20 +17,27 @@ Usage: index.html
             // draw datatable
             var table = dt_init(
                 selector="#example", // table id selector
-                url = "/api/agent/data/users?as_datatables=true&inc_fields=id,email,active", // data url source
+                url = "/api/agent/data/users?as_datatables=true&inc_fields=id,email,active", // data url source (as_columns=true is smaller for large tables)
                 dt_ajax=0, // 1=render columns manually (requires render_cols="col1,col2,col3", 0=render columns dynamically
                 render_cols=0, // columns rendered (only used when dt_ajax=1)
                 edit=1, // add a column with a edit icon
+                server_side=1, // 1=page, sort and search on the server (only one page is sent), 0=load all rows up to the limit
+                refresh=0, // seconds between refreshes, new and changed rows are added to the table (server_side=0 and dt_ajax=0 only)
             )
         });
       </script>
     </body>
   </html>
 */
-function draw_datatable(selector,url=0,data=0,dt_ajax=1,render_cols=0,edit=0) {
+function draw_datatable(selector,url=0,data=0,dt_ajax=1,render_cols=0,edit=0,server_side=0) {
     var dt_json = {
         "columnDefs":[{'targets': 0,'width': "5%"}]
     };
+    // Server side processing, the api answers draw/start/length/search/order with one page
+    if (url && server_side) {
+        dt_json["serverSide"] = true;
+        dt_json["processing"] = true;
+    };
     var edit_json = { // Icon for Actions
          'targets': -1,
          'searchable': false,
@@ -65,13 +72,26 @@ function draw_datatable(selector,url=0,data=0,dt_ajax=1,render_cols=0,edit=0) {
     return table
 }
 
-function dt_init(selector,url,dt_ajax=1,render_cols=0,edit=0) {
+function dt_init(selector,url,dt_ajax=1,render_cols=0,edit=0,server_side=0,refresh=0) {
     if (dt_ajax) {
-        draw_datatable(selector,url=url,data=0,dt_ajax=1,render_cols=render_cols,edit=edit)
+        draw_datatable(selector,url=url,data=0,dt_ajax=1,render_cols=render_cols,edit=edit,server_side=server_side)
+    } else if (server_side) {
+        // Fetch one row to get the column names, then let datatables request the pages
+        $.ajax({
+             type: "GET",
+             url: url,
+             data: {"draw":0,"start":0,"length":1},
+             contentType: 'application/json',
+             success: function(result) {
+                 draw_datatable(selector,url=url,data=0,dt_ajax=1,render_cols=result["columns"].join(","),edit=edit,server_side=1)
+             },
+             error: function(result) {console.log(result);}
+        });
     } else {
         $.ajax({
              type: "GET",
              url: url,
+             data: refresh ? {"etag":"true"} : {},
              contentType: 'application/json',
              success: function(result) {
                  // Create columns for table based on data["columns"]
@@ -79,13 +99,61 @@ function dt_init(selector,url,dt_ajax=1,render_cols=0,edit=0) {
                  $.each(columns,function(i) {
                      $(selector+">thead>tr").append('<th>'+columns[i]+'</th>');
                  });
-                 draw_datatable(selector,url=0,data=result["data"],dt_ajax=0,render_cols=0,edit=edit)
+                 // Column oriented results (as_columns=true) are turned into rows
+                 var data = result["values"] ? columns_to_rows(result) : result["data"];
+                 var table = draw_datatable(selector,url=0,data=data,dt_ajax=0,render_cols=0,edit=edit)
+                 if (refresh) {
+                     dt_refresh(table,url,result["since"],result["total"],refresh)
+                 }
              },
              error: function(result) {console.log(result);}
         });
     }
 }
 
+function dt_refresh(table,url,since,total,refresh) {
+    // Every `refresh` seconds, fetch the rows added or changed since the last response and add them to the table.
+    // Rows are matched on the first column (id). When rows were deleted (total went down) the page is reloaded
+    setInterval(function() {
+        $.ajax({
+            type: "GET",
+            url: url,
+            data: {"since":since},
+            ifModified: true,
+            contentType: 'application/json',
+            success: function(result,status) {
+                if (status == "notmodified" || !result) {
+                    return;
+                }
+                if (result["total"] < total) {
+                    window.location.reload();
+                    return;
+                }
+                since = result["since"];
+                total = result["total"];
+                var rows = result["values"] ? columns_to_rows(result) : result["data"];
+                var ids = rows.map(function(row) {return row[0];});
+                table.rows(function(index,data) {return ids.indexOf(data[0]) != -1;}).remove();
+                table.rows.add(rows).draw(false);
+            },
+            error: function(result) {console.log(result);}
+        });
+    },refresh*1000);
+}
+
+function columns_to_rows(result) {
+    // {"columns":["id","email"],"values":{"id":[1,2],"email":["a","b"]}} --> [[1,"a"],[2,"b"]]
+    var columns = result["columns"];
+    var rows = new Array(result["count"]);
+    for (var row = 0; row < result["count"]; row++) {
+        rows[row] = new Array(columns.length);
+        for (var col = 0; col < columns.length; col++) {
+            rows[row][col] = result["values"][columns[col]][row];
+        }
+    }
+    return rows
+}
+
 function ajax_method(url,method="POST",data={}) {
   $.ajax({
          type: method,
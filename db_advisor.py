@@ -0,0 +1,291 @@
+#// Record the query shapes DynamicQuery runs and propose the indexes that would serve the slow ones
+#// Usage:
+#//   register_hook(shape_recorder.observe)            (opt-in, see db_metrics.py)
+#//   shape_recorder.dump("shapes-%s.json" % os.getpid())
+#//   flask index-advisor --shapes "shapes-*.json"      (after IndexAdvisor().init_app(app))
+from flask import current_app
+from sqlalchemy import text, column, String
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+from app.utils.db_helper import DynamicQuery, Explain, TEXT_OPS
+from app.utils.db_metrics import percentile
+from app import db
+from collections import deque
+import threading
+import hashlib
+import json
+import glob
+import re
+
+#// Operators a GIN trigram index serves on text (the other column operators are served by a btree)
+TRIGRAM_OPS = ("like","ilike","notlike","notilike","contains","startswith","endswith") + tuple(TEXT_OPS)
+
+class ShapeRecorder():
+    '''
+    .Description: Aggregate the metric records of DynamicQuery per query shape (model, filter/qjson columns, JSON paths and operators,
+        orderby, groupby), with the observed latency and the last request of the shape to replay it. Opt-in, register it as a hook
+    .Example:
+        register_hook(shape_recorder.observe)
+
+        @app.route("/admin/query-shapes")
+        def query_shapes():
+            return jsonify(shape_recorder.summary())
+    '''
+    def __init__(self, samples=256):
+        self.samples = samples
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, record):
+        shape = record.get("shape")
+        if not shape or record.get("error") or record.get("cache_hit"):
+            return
+        key = json.dumps([record["model"],shape["filters"],shape["qjson"],shape["orderby"],shape["groupby"],shape["distinct"],shape["search"]],
+            default=str)
+        duration = record["phases"].get("total",0)
+        with self.lock:
+            entry = self.shapes.get(key)
+            if entry is None:
+                entry = {"model":record["model"],"shape":dict((k,v) for k,v in shape.items() if k != "request"),"count":0,"total_ms":0,
+                    "durations":deque(maxlen=self.samples),"request":None}
+                self.shapes[key] = entry
+            entry["count"] += 1
+            entry["total_ms"] += duration
+            entry["durations"].append(duration)
+            entry["request"] = shape["request"]
+
+    def summary(self):
+        '''
+        .Description --> Return the shapes, the most time spent first
+        .Returns --> [{"id":"..","model":"testtable","shape":{..},"count":120,"total_ms":5400.1,"p50_ms":40.2,"p95_ms":95.0,"request":{..}}]
+        '''
+        with self.lock:
+            shapes = []
+            for key,entry in self.shapes.items():
+                durations = list(entry["durations"])
+                shapes.append({"id":hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],"model":entry["model"],"shape":entry["shape"],
+                    "count":entry["count"],"total_ms":entry["total_ms"],"p50_ms":percentile(durations,0.5),"p95_ms":percentile(durations,0.95),
+                    "request":entry["request"]})
+        return sorted(shapes,key=lambda s: s["total_ms"],reverse=True)
+
+    def dump(self, path):
+        '''
+        .Description --> Write the summary to a JSON file (one per worker, the advisor merges them)
+        '''
+        with open(path,"w") as f:
+            json.dump(self.summary(),f,default=str)
+
+    def clear(self):
+        with self.lock:
+            self.shapes.clear()
+
+shape_recorder = ShapeRecorder()
+
+def load_shapes(paths):
+    '''
+    .Description --> Read and merge summaries written by ShapeRecorder.dump (glob patterns are expanded)
+    '''
+    merged = {}
+    for pattern in paths:
+        for path in glob.glob(pattern) or [pattern]:
+            with open(path) as f:
+                for shape in json.load(f):
+                    entry = merged.get(shape["id"])
+                    if entry is None:
+                        merged[shape["id"]] = dict(shape)
+                        continue
+                    entry["p50_ms"] = max(entry["p50_ms"] or 0,shape["p50_ms"] or 0)
+                    entry["p95_ms"] = max(entry["p95_ms"] or 0,shape["p95_ms"] or 0)
+                    entry["count"] += shape["count"]
+                    entry["total_ms"] += shape["total_ms"]
+    return sorted(merged.values(),key=lambda s: s["total_ms"],reverse=True)
+
+def index_name(table, parts, kind):
+    '''
+    .Description --> Return an index name (max 63 characters, postgres)
+    '''
+    name = re.sub(r"[^a-z0-9_]+","_",("ix_%s_%s_%s" % (table,"_".join(parts),kind)).lower())
+    return name[:63]
+
+def compile_expression(expression):
+    '''
+    .Description --> Render an expression with its values inline, as written in CREATE INDEX
+    '''
+    return str(expression.compile(dialect=postgresql.dialect(),compile_kwargs={"literal_binds":True}))
+
+def candidates(query, shape):
+    '''
+    .Description --> Return the indexes (name, CREATE INDEX statement, method) that could serve a shape:
+            btree on filter/orderby columns (filter column + orderby column when there is one equality filter),
+            GIN trigram on like/ilike/fuzzy/regex/prefix, GIN jsonb_path_ops on JSONB containment and
+            btree on the JSON subkey expression used for ranges (same expression and cast as DynamicQuery.json_astext)
+    '''
+    table = query.model.__tablename__
+    result = []
+
+    def add(parts, kind, using, expression):
+        name = index_name(table, parts, kind)
+        result.append((name, 'CREATE INDEX "%s" ON "%s" USING %s (%s)' % (name, table, using, expression), using))
+
+    equal = []
+    for key,op,mode in shape["filters"]:
+        attr = getattr(query.model, key, None)
+        if attr is None:
+            continue
+        if isinstance(attr.type, JSONB) and op == "contains":
+            add([key], "gin", "gin", '"%s" jsonb_path_ops' % key)
+        elif op in TRIGRAM_OPS and isinstance(attr.type, String):
+            add([key], "trgm", "gin", '"%s" gin_trgm_ops' % key)
+        else:
+            add([key], "btree", "btree", '"%s"' % key)
+            if op == "eq" and mode == "op":
+                equal.append(key)
+
+    samples = {"int":0,"float":0.0,"bool":True,"list":[],"str":""}
+    for op_list,name,subkeys,op,mode,kind in shape["qjson"]:
+        attr = getattr(query.model, name, None)
+        if attr is None:
+            continue
+        if mode == "contains":
+            add([name], "gin", "gin", '"%s" jsonb_path_ops' % name)
+        elif not subkeys:
+            if op in TRIGRAM_OPS and isinstance(attr.type, String):
+                add([name], "trgm", "gin", '"%s" gin_trgm_ops' % name)
+            else:
+                add([name], "btree", "btree", '"%s"' % name)
+        else:
+            expression = query.json_astext(column(name, attr.type), list(subkeys), samples.get(kind,""), cast=not (mode == "text" or op in TRIGRAM_OPS))
+            if mode == "text" or op in TRIGRAM_OPS:
+                add([name]+list(subkeys), "trgm", "gin", "(%s) gin_trgm_ops" % compile_expression(expression))
+            else:
+                add([name]+list(subkeys), "btree", "btree", "(%s)" % compile_expression(expression))
+
+    orderby = shape["orderby"]
+    if orderby and getattr(query.model, orderby[0], None) is not None:
+        order = '"%s"%s' % (orderby[0], " DESC" if query.getelement(orderby,1,None) == "desc" else "")
+        add([orderby[0]], "btree", "btree", order)
+        if len(equal) == 1 and equal[0] != orderby[0]:
+            add([equal[0],orderby[0]], "btree", "btree", '"%s", %s' % (equal[0], order))
+
+    #// One statement per index
+    unique = {}
+    for name,statement,using in result:
+        unique.setdefault(statement, (name,statement,using))
+    return list(unique.values())
+
+def plan_cost(session, statement):
+    '''
+    .Description --> Return the total cost the planner estimates for a statement
+    '''
+    plan = session.execute(Explain(statement, format="json")).scalar()
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Total Cost"]
+
+def existing_indexes(session, table):
+    '''
+    .Description --> Return the definitions of the indexes of a table, normalized to compare them with candidates
+    '''
+    rows = session.execute(text("SELECT indexdef FROM pg_indexes WHERE tablename = :table"), {"table":table})
+    return set(normalize_index(row[0]) for row in rows)
+
+def normalize_index(statement):
+    return re.sub(r'[\s"]', "", statement.split(" USING ",1)[-1]).lower()
+
+def has_hypopg(session):
+    return bool(session.execute(text("SELECT count(*) FROM pg_extension WHERE extname = 'hypopg'")).scalar())
+
+def advise(shapes, session=None, config=None, top=10, min_ms=0, real=False, min_gain=0.1):
+    '''
+    .Description: Propose indexes for the slowest shapes (most time spent, p95 >= min_ms), validated with EXPLAIN:
+        the cost of the last request of the shape before and after a hypothetical index (hypopg, btree only), or a real index
+        built in a rolled back transaction when real=True (locks writes on the table while it is built).
+        Candidates that do not lower the cost by min_gain (10%) are dropped, the others are sorted by the time they would save
+    .Example:
+        advise(load_shapes(["shapes-*.json"]), top=5)
+    .Returns --> [{"shape":"..","model":"testtable","count":120,"p95_ms":95.0,"index":"CREATE INDEX ...","cost_before":1840.2,
+        "cost_after":12.4,"gain":0.99,"validated":"hypopg"}]
+    '''
+    session = session or db.session
+    hypopg = has_hypopg(session)
+    proposals = []
+    seen = set()
+    for shape in [s for s in shapes if (s.get("p95_ms") or 0) >= min_ms][:top]:
+        request = dict(shape["request"] or {})
+        request.pop("search",None)
+        try:
+            query = DynamicQuery(model=shape["model"], session=session, config=config, as_query=True, use_plan_cache=False, use_rollup=False,
+                filter=[tuple(f) for f in request.pop("filter",[])], groupby=[tuple(g) for g in request.pop("groupby",[])],
+                orderby=tuple(request.pop("orderby",[])), **request)
+            statement = query.generate()
+            if isinstance(statement, dict):
+                raise Exception(statement.get("message"))
+            statement = statement.statement
+            cost_before = plan_cost(session, statement)
+        except Exception as e:
+            print("Skipping shape %s: %s" % (shape["id"], str(e)))
+            session.rollback()
+            continue
+        indexes = existing_indexes(session, query.model.__tablename__)
+        for name,create,using in candidates(query, shape["shape"]):
+            if normalize_index(create) in indexes or (shape["id"],create) in seen:
+                continue
+            seen.add((shape["id"],create))
+            cost_after,validated = None,None
+            try:
+                if hypopg and using == "btree":
+                    session.execute(text("SELECT * FROM hypopg_create_index(:statement)"), {"statement":create})
+                    cost_after,validated = plan_cost(session, statement),"hypopg"
+                    session.execute(text("SELECT hypopg_reset()"))
+                elif real:
+                    session.execute(text(create))
+                    cost_after,validated = plan_cost(session, statement),"real"
+            except Exception as e:
+                print("Could not validate %s: %s" % (name, str(e)))
+            finally:
+                session.rollback()
+            gain = None
+            if cost_after is not None:
+                gain = 1 - cost_after/cost_before if cost_before else 0
+                if gain < min_gain:
+                    continue
+            proposals.append({"shape":shape["id"],"model":shape["model"],"count":shape["count"],"p95_ms":shape["p95_ms"],
+                "total_ms":shape["total_ms"],"index":create.replace("CREATE INDEX","CREATE INDEX CONCURRENTLY",1),
+                "cost_before":cost_before,"cost_after":cost_after,"gain":gain,"validated":validated})
+    #// Validated first, then by the time they would save
+    return sorted(proposals,key=lambda p: (p["validated"] is not None, p["total_ms"]*(p["gain"] or 0)),reverse=True)
+
+class IndexAdvisor():
+    '''
+    .Description: Register the "flask index-advisor" command
+    .Example:
+        IndexAdvisor().init_app(app)
+
+        flask index-advisor --shapes "shapes-*.json" --top 10 --min-ms 200
+        flask index-advisor --shapes shapes.json --real --json
+    '''
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        import click
+
+        @app.cli.command("index-advisor")
+        @click.option("--shapes", multiple=True, required=True, help="summaries written by shape_recorder.dump (glob patterns)")
+        @click.option("--top", default=10, help="number of shapes to look at, the most time spent first")
+        @click.option("--min-ms", default=0.0, help="only shapes with a p95 above this (ms)")
+        @click.option("--real", is_flag=True, help="validate GIN indexes by building them in a rolled back transaction")
+        @click.option("--json", "as_json", is_flag=True, help="print the proposals as JSON")
+        def index_advisor(shapes, top, min_ms, real, as_json):
+            proposals = advise(load_shapes(shapes), config=current_app.config, top=top, min_ms=min_ms, real=real)
+            if as_json:
+                click.echo(json.dumps(proposals, indent=2, default=str))
+                return
+            for p in proposals:
+                if p["validated"]:
+                    cost = "cost %.1f -> %.1f (%s)" % (p["cost_before"], p["cost_after"], p["validated"])
+                else:
+                    cost = "cost %.1f, not validated" % p["cost_before"]
+                click.echo("-- %s shape %s: %s queries, p95 %.1fms, %s" % (p["model"], p["shape"], p["count"], p["p95_ms"] or 0, cost))
+                click.echo("%s;\n" % p["index"])
@@ -0,0 +1,64 @@
+#// Run several DynamicQuery requests (ie. every widget of a dashboard) in one call
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.db_helper import DynamicQuery
+from app.utils.formatmsg import msg_to_json
+from app import db
+import json
+
+def batch_query(specs, max_workers=None):
+    '''
+    .Description: Run a batch of DynamicQuery specs and return the results keyed like the specs.
+        Identical specs are run once. Queries run concurrently on a bounded pool (config BATCH_WORKERS or 4),
+        each worker checks out its own session, so keep it below the connection pool size
+    .Example:
+        @app.route("/api/batch", methods=["POST"])
+        def batch():
+            return jsonify(batch_query(request.get_json(silent=True)))
+
+        specs = {
+            "users_by_day": {"model":"users","as_chartjs":"true","groupby":"date_added,date_trunc,day","limit":100},
+            "last_users": {"model":"users","as_datatables":"true","inc_fields":"id,email","orderby":"id,desc"},
+            "sales": {"model":"testtable","as_json":"true","qjson":{"query":{"must_":[{"column":"data","subkeys":["sale"],"op":"gt","value":10}]}}},
+        }
+    .data -> {"key":{"model":"table","qjson":{},...parse_uri parameters}} --> {"key":result}
+    '''
+    if not isinstance(specs, dict):
+        return msg_to_json("Batch requires a dictionary of queries.")
+    if len(specs) > current_app.config.get("BATCH_MAX_QUERIES",50):
+        return msg_to_json("Too many queries in batch.")
+
+    #// Dedupe identical specs
+    unique = {}
+    keys = {}
+    for key,spec in specs.items():
+        fingerprint = json.dumps(spec, sort_keys=True, default=str)
+        unique.setdefault(fingerprint, spec)
+        keys[key] = fingerprint
+
+    app = current_app._get_current_object()
+    workers = max_workers or current_app.config.get("BATCH_WORKERS",4)
+    with ThreadPoolExecutor(max_workers=min(workers, len(unique) or 1)) as pool:
+        futures = dict((fingerprint, pool.submit(run_spec, app, spec)) for fingerprint,spec in unique.items())
+        results = dict((fingerprint, future.result()) for fingerprint,future in futures.items())
+    return dict((key, results[fingerprint]) for key,fingerprint in keys.items())
+
+def run_spec(app, spec):
+    '''
+    .Description --> Run one spec of a batch in its own app context and session (read only)
+    '''
+    with app.app_context():
+        try:
+            if not isinstance(spec, dict) or not spec.get("model"):
+                return msg_to_json("Invalid query. Model is mandatory.")
+            args = dict((k,v) for k,v in spec.items() if k not in ("model","qjson"))
+            if args.get("crud") or args.get("as_stream") or args.get("as_query"):
+                return msg_to_json("Only read queries are allowed in a batch.")
+            #// Results are sent back as JSON, python objects are not serializable
+            if not any(args.get(k) for k in ("as_json","as_datatables","as_chartjs","as_columns","as_schema","getcount")):
+                args["as_json"] = "true"
+            return DynamicQuery(model=spec["model"], request_args=args, qjson=spec.get("qjson") or {}).generate()
+        except Exception as e:
+            return msg_to_json(e)
+        finally:
+            db.session.remove()
@@ -0,0 +1,129 @@
+#// Result cache for DynamicQuery (read queries), invalidated by CRUD writes to the same model
+from collections import OrderedDict
+import threading
+import time
+import copy
+import json
+
+class MemoryResultCache():
+    '''
+    .Description: In-process LRU result cache with a TTL per entry. Bounded by number of entries and by max_bytes,
+        the size of a result is the length of its JSON encoding (measured once, when it is stored).
+        Results are copied in and out, so callers can change the result they get without changing the cached one
+    .Example:
+        set_result_cache(MemoryResultCache(max_entries=2048, max_bytes=256*1024*1024))
+    '''
+    json_only = False
+
+    def __init__(self, max_entries=1024, max_bytes=64*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict() #// (model,key) --> (expires,value,size)
+        self.lock = threading.Lock()
+
+    def get(self,model,key):
+        with self.lock:
+            entry = self.entries.get((model,key))
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self.remove((model,key))
+                self.misses += 1
+                return None
+            self.entries.move_to_end((model,key))
+            self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self,model,key,value,ttl):
+        try:
+            size = len(json.dumps(value,default=str))
+        except (TypeError,ValueError):
+            return
+        if self.max_bytes and size > self.max_bytes:
+            return
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.remove((model,key))
+            self.entries[(model,key)] = (time.time()+ttl,value,size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+
+    def remove(self,entry):
+        '''
+        .Description --> Drop an entry (the lock must be held)
+        '''
+        removed = self.entries.pop(entry,None)
+        if removed is not None:
+            self.bytes -= removed[2]
+
+    def invalidate(self,model):
+        with self.lock:
+            for entry in [k for k in self.entries if k[0] == model]:
+                self.remove(entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {"backend":"memory","max_entries":self.max_entries,"max_bytes":self.max_bytes,"entries":len(self.entries),"bytes":self.bytes,
+            "hits":self.hits,"misses":self.misses}
+
+class RedisResultCache():
+    '''
+    .Description: Result cache shared by all workers (gunicorn) through redis. Values are stored as JSON (json_only),
+        DynamicQuery does not cache as_object results here since their rows would come back as lists. Invalidation bumps a generation
+        counter per model, so old entries are never read again and expire with their TTL.
+        Memory is bounded by the redis maxmemory policy (use allkeys-lru)
+    .Example:
+        import redis
+        set_result_cache(RedisResultCache(redis.Redis.from_url("redis://localhost:6379/0")))
+    '''
+    json_only = True
+
+    def __init__(self, client, prefix="dq"):
+        self.client = client
+        self.prefix = prefix
+
+    def generation(self,model):
+        return int(self.client.get("%s:gen:%s" % (self.prefix,model)) or 0)
+
+    def get(self,model,key):
+        value = self.client.get("%s:%s:%s:%s" % (self.prefix,model,self.generation(model),key))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self,model,key,value,ttl):
+        try:
+            value = json.dumps(value,default=str)
+        except TypeError:
+            return
+        self.client.set("%s:%s:%s:%s" % (self.prefix,model,self.generation(model),key),value,ex=int(ttl))
+
+    def invalidate(self,model):
+        self.client.incr("%s:gen:%s" % (self.prefix,model))
+
+    def clear(self):
+        for key in self.client.scan_iter("%s:*" % self.prefix):
+            self.client.delete(key)
+
+    def stats(self):
+        return {"backend":"redis","prefix":self.prefix}
+
+result_cache = MemoryResultCache()
+
+def set_result_cache(backend):
+    '''
+    .Description --> Replace the result cache backend (MemoryResultCache, RedisResultCache or any object with get/set/invalidate).
+        Backends that store JSON set json_only = True
+    '''
+    global result_cache
+    result_cache = backend
+
+def get_result_cache():
+    return result_cache
@@ -0,0 +1,96 @@
+#// Encode DynamicQuery results as JSON, MessagePack or Arrow IPC, negotiated with the Accept header
+from flask import Response, jsonify
+import datetime
+import decimal
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+MSGPACK = "application/x-msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+def available_formats():
+    '''
+    .Description --> Return the mimetypes that can be sent, MessagePack and Arrow need the msgpack/pyarrow packages
+    '''
+    formats = ["application/json"]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if pyarrow is not None:
+        formats.append(ARROW)
+    return formats
+
+def negotiate(accept, dataset=None):
+    '''
+    .Description --> Pick the mimetype of the response from an Accept header (request.accept_mimetypes).
+        Arrow is only sent for column oriented results (as_columns)
+    '''
+    formats = available_formats()
+    if not (isinstance(dataset,dict) and "values" in dataset) and ARROW in formats:
+        formats.remove(ARROW)
+    return accept.best_match(formats, default="application/json") or "application/json"
+
+def encode_value(value):
+    '''
+    .Description --> Convert the values MessagePack can not encode (dates, decimals, uuids ...)
+    '''
+    if isinstance(value,decimal.Decimal):
+        return float(value)
+    if isinstance(value,(datetime.datetime,datetime.date,datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+def to_arrow(dataset):
+    '''
+    .Description --> Encode a column oriented result as an Arrow IPC stream. JSON values (dict/list) are sent as JSON strings
+    '''
+    arrays = []
+    for column in dataset["columns"]:
+        values = dataset["values"][column]
+        if any(isinstance(value,(dict,list)) for value in values):
+            values = [None if value is None else json.dumps(value,default=str) for value in values]
+        try:
+            arrays.append(pyarrow.array(values))
+        except (pyarrow.ArrowInvalid,pyarrow.ArrowTypeError):
+            arrays.append(pyarrow.array([None if value is None else str(value) for value in values]))
+    table = pyarrow.Table.from_arrays(arrays, names=dataset["columns"])
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def make_response(dataset, accept):
+    '''
+    .Description: Return a flask Response with the result in the format asked for by the client, with the ETag of the result
+        (etag=true or since) and 304 Not Modified when the result did not change
+    .Example:
+        @app.route("/api/<table>")
+        def api(table):
+            dataset = DynamicQuery(model=table,request_args=request.args,if_none_match=request.headers.get("If-None-Match")).generate()
+            return make_response(dataset, request.accept_mimetypes)
+
+        curl -H "Accept: application/x-msgpack" "http://localhost/api/testtable?as_columns=true&limit=100000"
+    '''
+    etag = dataset.get("etag") if isinstance(dataset,dict) else None
+    mimetype = negotiate(accept, dataset)
+    if etag and dataset.get("not_modified"):
+        response = Response(status=304)
+    elif mimetype == MSGPACK:
+        response = Response(msgpack.packb(dataset, default=encode_value, use_bin_type=True), mimetype=MSGPACK)
+    elif mimetype == ARROW:
+        response = Response(to_arrow(dataset), mimetype=ARROW)
+    else:
+        response = jsonify(dataset)
+    #// The body depends on the Accept header, shared caches must not serve one format to another client
+    response.headers["Vary"] = "Accept"
+    if etag:
+        response.headers["ETag"] = etag
+    return response
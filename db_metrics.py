@@ -0,0 +1,127 @@
+#// Instrumentation for DynamicQuery: metric hooks, per query shape aggregates and the slow query log
+from collections import deque
+import threading
+import logging
+
+logger = logging.getLogger("dynamicquery")
+
+hooks = []
+
+def register_hook(callback):
+    '''
+    .Description --> Call `callback(record)` after every DynamicQuery.generate() (see DynamicQuery.metrics for the record)
+    .Example:
+        register_hook(lambda record: statsd.timing("query."+record["model"], record["phases"]["total"]))
+    '''
+    if callback not in hooks:
+        hooks.append(callback)
+
+def remove_hook(callback):
+    if callback in hooks:
+        hooks.remove(callback)
+
+def metrics_enabled(config):
+    '''
+    .Description --> Metrics are collected when a hook is registered or QUERY_METRICS/SLOW_QUERY_MS is configured
+    '''
+    return bool(hooks or config.get("QUERY_METRICS") or config.get("SLOW_QUERY_MS"))
+
+def emit_metrics(record, config=None):
+    '''
+    .Description --> Aggregate a metric record, log it if it is slow and send it to the hooks
+    '''
+    query_metrics.observe(record)
+    slow_ms = (config or {}).get("SLOW_QUERY_MS") or query_metrics.slow_ms
+    if slow_ms and record["phases"].get("total",0) >= float(slow_ms):
+        logger.warning("slow query %.1fms model=%s fingerprint=%s rows=%s phases=%s sql=%s",
+            record["phases"]["total"], record["model"], record["fingerprint"], record["rows"], record["phases"], record["sql"])
+    for callback in list(hooks):
+        try:
+            callback(record)
+        except Exception as e:
+            print("Metric hook failed: %s" % str(e))
+
+def percentile(values, q):
+    '''
+    .Description --> Return the q (0-1) percentile of a list of numbers
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values)-1, int(round(q*(len(values)-1))))
+    return values[index]
+
+class QueryMetrics():
+    '''
+    .Description: Aggregate DynamicQuery metrics per query shape (SQL fingerprint). Durations are kept in a window
+        of the last `samples` queries per shape for the p50/p95
+    .Example:
+        @app.route("/metrics")
+        def metrics():
+            return Response(query_metrics.render(), mimetype="text/plain")
+    '''
+    def __init__(self, samples=1024, slow_ms=None):
+        self.samples = samples
+        self.slow_ms = slow_ms
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, record):
+        key = record.get("fingerprint") or "model:%s" % record.get("model")
+        with self.lock:
+            shape = self.shapes.get(key)
+            if shape is None:
+                shape = {"model":record.get("model"),"sql":record.get("sql"),"count":0,"errors":0,"rows":0,"bytes":0,"phases":{}}
+                self.shapes[key] = shape
+            shape["count"] += 1
+            if record.get("error"):
+                shape["errors"] += 1
+            shape["rows"] += record.get("rows") or 0
+            #// bytes are measured for a sample of the queries (METRICS_BYTES_SAMPLE), scaled to estimate the total
+            if record.get("bytes") is not None:
+                shape["bytes"] += int(record["bytes"]/(record.get("bytes_sample") or 1))
+            for phase,duration in record.get("phases",{}).items():
+                shape["phases"].setdefault(phase, deque(maxlen=self.samples)).append(duration)
+
+    def summary(self):
+        '''
+        .Description --> Return {fingerprint: {"model","count","errors","rows","bytes","phases":{phase:{"p50","p95"}}}}
+        '''
+        with self.lock:
+            summary = {}
+            for key,shape in self.shapes.items():
+                phases = {}
+                for phase,durations in shape["phases"].items():
+                    durations = list(durations)
+                    phases[phase] = {"p50":percentile(durations,0.5),"p95":percentile(durations,0.95)}
+                summary[key] = {"model":shape["model"],"sql":shape["sql"],"count":shape["count"],"errors":shape["errors"],
+                    "rows":shape["rows"],"bytes":shape["bytes"],"phases":phases}
+            return summary
+
+    def render(self):
+        '''
+        .Description --> Return the aggregates in the Prometheus text format
+        '''
+        lines = [
+            "# TYPE dynamicquery_phase_ms summary",
+            "# TYPE dynamicquery_queries_total counter",
+            "# TYPE dynamicquery_errors_total counter",
+            "# TYPE dynamicquery_rows_total counter",
+            "# TYPE dynamicquery_bytes_total counter",
+        ]
+        for key,shape in self.summary().items():
+            labels = 'shape="%s",model="%s"' % (key, shape["model"])
+            for phase,quantiles in shape["phases"].items():
+                lines.append('dynamicquery_phase_ms{%s,phase="%s",quantile="0.5"} %s' % (labels, phase, quantiles["p50"]))
+                lines.append('dynamicquery_phase_ms{%s,phase="%s",quantile="0.95"} %s' % (labels, phase, quantiles["p95"]))
+            lines.append('dynamicquery_queries_total{%s} %s' % (labels, shape["count"]))
+            lines.append('dynamicquery_errors_total{%s} %s' % (labels, shape["errors"]))
+            lines.append('dynamicquery_rows_total{%s} %s' % (labels, shape["rows"]))
+            lines.append('dynamicquery_bytes_total{%s} %s' % (labels, shape["bytes"]))
+        return "\n".join(lines)+"\n"
+
+    def clear(self):
+        with self.lock:
+            self.shapes.clear()
+
+query_metrics = QueryMetrics()
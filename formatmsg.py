@@ -10,4 +10,8 @@ def msg_to_json(message="None",result=False,label="warning",**kwargs):
         "type":str(label),
         "id":kwargs.get("id")
     }
+    #// Any other details of the result (ie. counts)
+    for key,value in kwargs.items():
+        if key != "id":
+            message[key] = value
     return message
@@ -7,3 +7,11 @@ class TestTable(db.Model):
     data = db.Column(JSONB)
     message = db.Column(db.String)
     istrue = db.Column(db.Boolean, default=False)
+
+    #// GIN index for eq/in filters on JSON subkeys (compiled to @> containment) and an expression index for ranges on data->>'sale'
+    __table_args__ = (
+        db.Index("ix_testtable_data", data, postgresql_using="gin", postgresql_ops={"data": "jsonb_path_ops"}),
+        db.Index("ix_testtable_data_sale", db.text("((data->>'sale')::integer)")),
+    )
+    #// Cast used by DynamicQuery for range filters on a JSON subkey, must match the expression index
+    __json_casts__ = {"data.sale": db.Integer}